@@ -1,9 +1,20 @@
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import re
+import threading
 import streamlit as st
-import base64
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import pybase64 as base64
+import io
 import os
-import json
+import orjson
+import diskcache
+import httpx
+from PIL import Image
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, BadRequestError
 
 # Load environment variables
 load_dotenv()
@@ -14,19 +25,84 @@ if not api_key_openai:
     st.error("OPENAI_API_KEY not found in environment variables. Please create a .env file with your OpenAI API key.")
     st.stop()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=api_key_openai)
+# Initialize OpenAI client. st.cache_resource keeps one client (and its
+# underlying connection pool) alive across Streamlit reruns, so calls reuse
+# the warm TLS session instead of re-handshaking with api.openai.com, and
+# HTTP/2 lets concurrent calls multiplex over a single connection.
+@st.cache_resource
+def get_client():
+    return AsyncOpenAI(
+        api_key=api_key_openai,
+        http_client=httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            timeout=60.0
+        )
+    )
 
-def generate_ad_concept(brand_info, target_audience, marketing_goal):
-    """Generate Facebook ad concept using GPT-4"""
-    st.info("Generating initial ad concept...")
-    
-    prompt = f"""
+client = get_client()
+
+# Persistent event loop on a background thread. asyncio.run would build
+# and tear down a loop per click, stranding the cached client's
+# keep-alive connections (the next click would pull a connection bound
+# to the closed loop and fail); running everything on one long-lived
+# loop keeps client, pool, and loop alive together.
+@st.cache_resource
+def get_background_loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    return loop, thread
+
+def run_async(coro):
+    """Run a coroutine on the persistent background loop and wait for it.
+
+    The current script-run context is attached to the loop thread so the
+    st.* calls inside the coroutines render into this session.
+    """
+    loop, thread = get_background_loop()
+    add_script_run_ctx(thread, get_script_run_ctx())
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+# Worker pool for the CPU-bound codec work (base64 decode, thumbnailing).
+# pybase64 and Pillow release the GIL, so running them off the script
+# thread keeps Streamlit's spinner and UI updates flowing.
+@st.cache_resource
+def get_executor():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+_executor = get_executor()
+
+async def _in_executor(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+# Disk-backed cache for chat completions. From the app's viewpoint both
+# prompt helpers are pure functions of their string inputs, so repeated
+# clicks with the same brief return in microseconds instead of seconds.
+_chat_cache = diskcache.Cache("./.gpt_cache")
+
+# Content-addressed cache for gpt-image-1 results — the most expensive
+# calls in the app. Repeated prompts (common while iterating on the
+# concept) return instantly instead of paying a 5-15 s render.
+_image_cache = diskcache.Cache("./.image_cache")
+
+def _cache_key(*parts):
+    """Stable cache key from the strings that determine a completion."""
+    return hashlib.sha256(orjson.dumps(list(parts))).hexdigest()
+
+# Prompt templates and system messages built once at import; call sites
+# only interpolate the per-request values with str.format
+_SYS_CONCEPT = {
+    "role": "system",
+    "content": "You are a professional ad copywriter. Return only valid JSON with all required fields."
+}
+
+_CONCEPT_TMPL = """
     Create a Facebook ad concept based on:
-    - Brand: {brand_info}
-    - Audience: {target_audience}
-    - Goal: {marketing_goal}
-    
+    - Brand: {brand}
+    - Audience: {audience}
+    - Goal: {goal}
+
     Return JSON with these fields:
     - headline: Catchy headline (5-7 words)
     - primary_text: Main ad copy (1-2 sentences)
@@ -34,17 +110,111 @@ def generate_ad_concept(brand_info, target_audience, marketing_goal):
     - cta: Call-to-action (e.g., "Shop Now")
     - image_edit_instructions: Detailed instructions for image editing
     """
+
+_SYS_CRITIQUE = {
+    "role": "system",
+    "content": "You are an expert image editor. When providing instructions, ensure they are safe, professional, and suitable for all audiences. Avoid any requests that could be interpreted as explicit, violent, or inappropriate. Focus on visual improvements such as color adjustments, composition changes, and element positioning. Return JSON starting with 'recommendation' (either 'edit' or 'new'), then either 'edit_instructions' or 'generation_instructions' based on your recommendation, then 'critique'. Respond with at most 400 tokens of JSON only — no prose padding."
+}
+
+_CRITIQUE_TMPL = """
+    Analyze this Facebook ad (iteration {iteration}) and suggest improvements:
+
+    Current Ad:
+    - Headline: {headline}
+    - Primary Text: {primary_text}
+    - CTA: {cta}
+
+    Provide specific feedback on:
+    1. Headline effectiveness and alternatives
+    2. Element additions/removals
+    3. Visual elements that need modification
+    4. Composition adjustments
+    5. Color scheme improvements
+    6. Element positioning optimizations
+
+    When suggesting instructions, be as specific as possible and ensure they are safe, professional, and suitable for all audiences. Avoid any requests that could be interpreted as explicit, violent, or inappropriate. Focus on aesthetic improvements such as color adjustments, composition changes, and element positioning.
+
+    For example, instead of saying 'make it better', say 'increase the brightness of the background' or 'add a soft shadow to the text'.
+
+    Return JSON with the fields in exactly this order:
+    - recommendation: Either "edit" or "new" based on whether you recommend editing the current image or creating a new one
+    - edit_instructions: Detailed editing instructions if recommendation is "edit"
+    - generation_instructions: Detailed generation instructions if recommendation is "new"
+    - critique: Concise analysis addressing all 7 points above
+    - headline_variants: 3 improved headline options
+    """
+
+_SYS_PLAN = {
+    "role": "system",
+    "content": "You are an expert image editor. When providing instructions, ensure they are safe, professional, and suitable for all audiences. Avoid any requests that could be interpreted as explicit, violent, or inappropriate. Return JSON with an 'edit_plan' list of {step, edit_instructions} objects."
+}
+
+_PLAN_TMPL = """
+    Analyze this Facebook ad and plan {num_steps} successive rounds of image edits:
+
+    Current Ad:
+    - Headline: {headline}
+    - Primary Text: {primary_text}
+    - CTA: {cta}
+
+    Each step should build on the result of the previous one, covering
+    composition adjustments, color scheme improvements, element positioning
+    and additions/removals. Be as specific as possible and ensure every
+    instruction is safe, professional, and suitable for all audiences.
+    Focus on aesthetic improvements such as color adjustments, composition
+    changes, and element positioning.
+
+    For example, instead of saying 'make it better', say 'increase the brightness of the background' or 'add a soft shadow to the text'.
+
+    Return JSON with:
+    - edit_plan: list of exactly {num_steps} objects, each with "step" (1-based) and "edit_instructions" (detailed editing instructions for that step)
+    """
+
+# Required response fields, checked with frozenset.issubset so validation
+# runs in C instead of a Python-level loop
+_REQUIRED_CONCEPT = frozenset(('headline', 'primary_text', 'cta', 'image_edit_instructions'))
+_REQUIRED_CRITIQUE = frozenset(('critique', 'recommendation'))
+
+# Spot completed values in a partial JSON token stream so the image edit
+# can start before the rest of the critique finishes generating
+_RECOMMENDATION_RE = re.compile(r'"recommendation"\s*:\s*"(edit|new)"')
+_EDIT_INSTRUCTIONS_RE = re.compile(r'"edit_instructions"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+@functools.lru_cache(maxsize=16)
+def _critique_data_url(png_bytes):
+    """Downscaled JPEG data URL for the vision critique calls.
+
+    The critique uses detail="low", which resizes to ~512px server-side
+    anyway, so uploading the full 1024px PNG only inflates the payload.
+    A 512px JPEG is 10-20x smaller to encode and send. Memoized so
+    repeated critiques of the same image (reruns, plan + per-step paths)
+    encode it only once.
+    """
+    im = Image.open(io.BytesIO(png_bytes)).convert("RGB")
+    im.thumbnail((512, 512), Image.LANCZOS)
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=85)
+    return "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode()
+
+async def generate_ad_concept(brand_info, target_audience, marketing_goal):
+    """Generate Facebook ad concept using GPT-4"""
+    st.info("Generating initial ad concept...")
     
+    prompt = _CONCEPT_TMPL.format(brand=brand_info, audience=target_audience, goal=marketing_goal)
+
+    cache_key = _cache_key("gpt-4-turbo", prompt)
+    if not st.session_state.get('force_regenerate'):
+        cached = _chat_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4-turbo",
             messages=[
+                _SYS_CONCEPT,
                 {
-                    "role": "system", 
-                    "content": "You are a professional ad copywriter. Return only valid JSON with all required fields."
-                },
-                {
-                    "role": "user", 
+                    "role": "user",
                     "content": prompt
                 }
             ],
@@ -52,11 +222,11 @@ def generate_ad_concept(brand_info, target_audience, marketing_goal):
             temperature=0.7
         )
         
-        result = json.loads(response.choices[0].message.content)
+        result = orjson.loads(response.choices[0].message.content)
         
         # Validate all required fields are present
-        required_fields = ['headline', 'primary_text', 'cta', 'image_edit_instructions']
-        if all(field in result for field in required_fields):
+        if _REQUIRED_CONCEPT.issubset(result):
+            _chat_cache[cache_key] = result
             return result
         else:
             st.error(f"Missing required fields in response: {result}")
@@ -66,120 +236,135 @@ def generate_ad_concept(brand_info, target_audience, marketing_goal):
         st.error(f"Failed to generate concept: {str(e)}")
         return None
 
-def generate_initial_image(prompt):
-    """Generate initial image using GPT-Image-1"""
+async def generate_initial_image(prompt, final=False):
+    """Generate image using GPT-Image-1 (low-quality draft unless final)"""
     st.info("Generating initial image...")
-    
+
+    quality = "high" if final else "low"
+    cache_key = _cache_key("gen", "1024x1024", quality, prompt)
+    if not st.session_state.get('force_regenerate'):
+        cached = _image_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     try:
-        response = client.images.generate(
+        response = await client.images.generate(
             model="gpt-image-1",
             prompt=prompt,
             n=1,
             size="1024x1024",
-            quality="low",
+            quality=quality,
         )
-        
-        # Get the base64 encoded image directly
-        image_b64 = response.data[0].b64_json
-        return f"data:image/png;base64,{image_b64}"
-            
+
+        # Decode straight to raw PNG bytes; consumers that need base64
+        # (the vision critique) re-encode on demand
+        png_bytes = await _in_executor(base64.b64decode, response.data[0].b64_json)
+        _image_cache[cache_key] = png_bytes
+        return png_bytes
+
+    except BadRequestError as e:
+        if getattr(e, 'code', None) == 'moderation_blocked':
+            st.error("Generation prompt was blocked by moderation. Please rephrase the instructions and try again.")
+        else:
+            st.error(f"Image generation error: {str(e)}")
+        return None
     except Exception as e:
         st.error(f"Image generation error: {str(e)}")
         return None
 
-def edit_image_with_prompt(base_image, edit_instructions):
-    """Edit existing image using GPT-Image-1"""
+async def edit_image_with_prompt(base_image_bytes, edit_instructions, final=False):
+    """Edit existing image using GPT-Image-1 (low-quality draft unless final)"""
     st.info("Editing image based on feedback...")
-    
+
+    quality = "high" if final else "low"
+    cache_key = _cache_key(
+        "edit", quality,
+        hashlib.sha256(base_image_bytes).hexdigest(),
+        str(edit_instructions)
+    )
+    if not st.session_state.get('force_regenerate'):
+        cached = _image_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     try:
-        # Decode the base64 image data
-        image_data = base64.b64decode(base_image.split(",")[1])
-        
-        # Save temporarily to file (OpenAI API requires a file)
-        with open("temp_image.png", "wb") as f:
-            f.write(image_data)
-        
+        # Wrap the raw PNG bytes in an in-memory file
+        # (the API only needs a file-like object with a .name)
+        img_file = io.BytesIO(base_image_bytes)
+        img_file.name = "image.png"
+
         # Log the edit instructions
         st.write("### Edit Instructions Sent to API")
         st.write(edit_instructions)
-        
-        # Open file for API
-        with open("temp_image.png", "rb") as img_file:
-            # Ensure edit_instructions is a string
-            if not isinstance(edit_instructions, str):
-                edit_instructions = str(edit_instructions)
-                
-            response = client.images.edit(
-                model="gpt-image-1",
-                image=img_file,
-                prompt=edit_instructions,
-                n=1,
-                size="1024x1024"
-            )
-        
-        # Get the base64 encoded image directly
-        image_b64 = response.data[0].b64_json
-        
-        # Clean up temp file
-        if os.path.exists("temp_image.png"):
-            os.remove("temp_image.png")
-            
-        return f"data:image/png;base64,{image_b64}"
-            
+
+        # Ensure edit_instructions is a string
+        if not isinstance(edit_instructions, str):
+            edit_instructions = str(edit_instructions)
+
+        response = await client.images.edit(
+            model="gpt-image-1",
+            image=img_file,
+            prompt=edit_instructions,
+            n=1,
+            size="1024x1024",
+            quality=quality
+        )
+
+        # Decode straight to raw PNG bytes
+        png_bytes = await _in_executor(base64.b64decode, response.data[0].b64_json)
+        _image_cache[cache_key] = png_bytes
+        return png_bytes
+
+    except BadRequestError as e:
+        if getattr(e, 'code', None) == 'moderation_blocked':
+            st.error("Edit instructions were blocked by moderation. Please rephrase the instructions and try again.")
+        else:
+            st.error(f"Image editing error: {str(e)}")
+        return None
     except Exception as e:
         st.error(f"Image editing error: {str(e)}")
-        # Clean up temp file if it exists
-        if os.path.exists("temp_image.png"):
-            os.remove("temp_image.png")
         return None
 
-def analyze_and_improve(image_b64, ad_concept, iteration):
-    """Analyze ad and suggest editing improvements"""
-    st.info(f"Analyzing iteration {iteration}...")
-    
-    critique_prompt = f"""
-    Analyze this Facebook ad (iteration {iteration}) and suggest improvements:
-    
-    Current Ad:
-    - Headline: {ad_concept['headline']}
-    - Primary Text: {ad_concept['primary_text']}
-    - CTA: {ad_concept['cta']}
-    
-    Provide specific feedback on:
-    1. Headline effectiveness and alternatives
-    2. Element additions/removals
-    3. Visual elements that need modification
-    4. Composition adjustments
-    5. Color scheme improvements
-    6. Element positioning optimizations
-    
-    When suggesting instructions, be as specific as possible and ensure they are safe, professional, and suitable for all audiences. Avoid any requests that could be interpreted as explicit, violent, or inappropriate. Focus on aesthetic improvements such as color adjustments, composition changes, and element positioning.
-    
-    For example, instead of saying 'make it better', say 'increase the brightness of the background' or 'add a soft shadow to the text'.
-    
-    Return JSON with:
-    - critique: Concise analysis addressing all 7 points above
-    - recommendation: Either "edit" or "new" based on whether you recommend editing the current image or creating a new one
-    - edit_instructions: Detailed editing instructions if recommendation is "edit"
-    - generation_instructions: Detailed generation instructions if recommendation is "new"
-    - headline_variants: 3 improved headline options
+async def analyze_and_improve(image_bytes, ad_concept, iteration, on_edit_ready=None):
+    """Analyze ad and suggest editing improvements.
+
+    The critique is streamed; if on_edit_ready is given it is called with
+    the edit instructions as soon as they are complete in the token
+    stream, so the caller can start the image edit while the rest of the
+    critique is still generating.
     """
+    st.info(f"Analyzing iteration {iteration}...")
     
+    critique_prompt = _CRITIQUE_TMPL.format(
+        iteration=iteration,
+        headline=ad_concept['headline'],
+        primary_text=ad_concept['primary_text'],
+        cta=ad_concept['cta']
+    )
+
+    image_url = await _in_executor(_critique_data_url, image_bytes)
+
+    # Key on the full image digest: a prefix of the JPEG thumbnail URL is
+    # all format headers and identical across different images.
+    cache_key = _cache_key("gpt-4-turbo", critique_prompt,
+                           hashlib.sha256(image_bytes).hexdigest())
+    if not st.session_state.get('force_regenerate'):
+        cached = _chat_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     try:
-        response = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             model="gpt-4-turbo",
             messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert image editor. When providing instructions, ensure they are safe, professional, and suitable for all audiences. Avoid any requests that could be interpreted as explicit, violent, or inappropriate. Focus on visual improvements such as color adjustments, composition changes, and element positioning. Return JSON with 'critique', 'recommendation' (either 'edit' or 'new'), and either 'edit_instructions' or 'generation_instructions' based on your recommendation."
-                },
+                _SYS_CRITIQUE,
                 {
                     "role": "user",
                     "content": [
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": image_b64,
+                                "url": image_url,
                                 "detail": "low"
                             }
                         },
@@ -191,19 +376,37 @@ def analyze_and_improve(image_b64, ad_concept, iteration):
                 }
             ],
             response_format={"type": "json_object"},
-            max_tokens=1500
+            max_tokens=600,
+            stream=True
         )
-        
-        result = json.loads(response.choices[0].message.content)
+
+        # Accumulate the token stream, firing the edit callback the moment
+        # a completed "edit" recommendation and its instructions appear
+        content_parts = []
+        edit_started = False
+        async for chunk in stream:
+            if not chunk.choices or chunk.choices[0].delta.content is None:
+                continue
+            content_parts.append(chunk.choices[0].delta.content)
+            if on_edit_ready is not None and not edit_started:
+                buffer = "".join(content_parts)
+                rec_match = _RECOMMENDATION_RE.search(buffer)
+                edit_match = _EDIT_INSTRUCTIONS_RE.search(buffer)
+                if rec_match and rec_match.group(1) == 'edit' and edit_match:
+                    on_edit_ready(orjson.loads(f'"{edit_match.group(1)}"'))
+                    edit_started = True
+
+        result = orjson.loads("".join(content_parts))
         
         # Validate response contains required fields
-        if 'critique' in result and 'recommendation' in result:
+        if _REQUIRED_CRITIQUE.issubset(result):
             if result['recommendation'] == 'edit' and 'edit_instructions' not in result:
                 st.error("Missing edit instructions in critique response")
                 return None
             elif result['recommendation'] == 'new' and 'generation_instructions' not in result:
                 st.error("Missing generation instructions in critique response")
                 return None
+            _chat_cache[cache_key] = result
             return result
         else:
             st.error(f"Missing required fields in critique: {result}")
@@ -213,6 +416,85 @@ def analyze_and_improve(image_b64, ad_concept, iteration):
         st.error(f"Analysis error: {str(e)}")
         return None
 
+async def generate_edit_plan(image_bytes, ad_concept, num_steps):
+    """Ask for all edit steps in a single call instead of one critique per iteration"""
+    st.info(f"Planning {num_steps} edit steps...")
+
+    plan_prompt = _PLAN_TMPL.format(
+        num_steps=num_steps,
+        headline=ad_concept['headline'],
+        primary_text=ad_concept['primary_text'],
+        cta=ad_concept['cta']
+    )
+
+    image_url = await _in_executor(_critique_data_url, image_bytes)
+
+    cache_key = _cache_key("gpt-4-turbo", plan_prompt,
+                           hashlib.sha256(image_bytes).hexdigest())
+    if not st.session_state.get('force_regenerate'):
+        cached = _chat_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    try:
+        response = await client.chat.completions.create(
+            model="gpt-4-turbo",
+            messages=[
+                _SYS_PLAN,
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": image_url,
+                                "detail": "low"
+                            }
+                        },
+                        {
+                            "type": "text",
+                            "text": plan_prompt
+                        }
+                    ]
+                }
+            ],
+            response_format={"type": "json_object"},
+            max_tokens=1500
+        )
+
+        result = orjson.loads(response.choices[0].message.content)
+
+        plan = result.get('edit_plan')
+        if isinstance(plan, list) and plan and all('edit_instructions' in step for step in plan):
+            _chat_cache[cache_key] = plan
+            return plan
+        else:
+            st.error(f"Missing edit plan in response: {result}")
+            return None
+
+    except Exception as e:
+        st.error(f"Planning error: {str(e)}")
+        return None
+
+# Cached render helpers: Streamlit replays the recorded elements on
+# reruns instead of re-serializing unchanged images and JSON for every
+# button click. Keyed on the arguments, so only changed iterations pay.
+@st.cache_data
+def render_concept(concept):
+    st.json(concept)
+
+@st.cache_data
+def render_iteration_image(image_bytes, caption):
+    st.image(image_bytes, use_container_width=True)
+    st.caption(caption)
+
+@st.cache_data
+def render_feedback(critique, recommendation):
+    st.write("### Feedback")
+    st.write(critique)
+    if recommendation:
+        st.write(f"**AI Recommendation:** {recommendation.capitalize()} the image")
+
 def main():
     st.title("🖼️ AI Image Editing Studio")
     st.subheader("Iterative image editing with GPT-Image-1")
@@ -226,11 +508,23 @@ def main():
         st.session_state.max_iterations = 3
     if 'ad_concept' not in st.session_state:
         st.session_state.ad_concept = None
-    
+    if 'edit_plan' not in st.session_state:
+        st.session_state.edit_plan = None
+
     # Configuration sidebar
     with st.sidebar:
         st.header("Settings")
         st.session_state.max_iterations = st.slider("Number of edits", 1, 10, 3)
+        reanalyze_each_step = st.checkbox(
+            "Re-analyze each step",
+            value=False,
+            help="Run a fresh critique before every edit instead of planning all steps in one call"
+        )
+        st.session_state.force_regenerate = st.checkbox(
+            "Force regenerate",
+            value=False,
+            help="Bypass the cached images, critiques, and plans and always call the models"
+        )
     
     # Input form
     with st.form("ad_input_form"):
@@ -245,18 +539,23 @@ def main():
         if st.form_submit_button("Start Editing Process"):
             st.session_state.iterations = []
             st.session_state.current_iteration = 0
-            st.session_state.ad_concept = generate_ad_concept(brand_info, target_audience, marketing_goal)
-            
-            if st.session_state.ad_concept:
+            st.session_state.edit_plan = None
+
+            async def bootstrap():
+                concept = await generate_ad_concept(brand_info, target_audience, marketing_goal)
+                if not concept:
+                    return None, None
                 # Generate initial image using proper generation endpoint
-                initial_image = generate_initial_image(
-                    st.session_state.ad_concept['image_edit_instructions']
-                )
-                
+                image = await generate_initial_image(concept['image_edit_instructions'])
+                return concept, image
+
+            st.session_state.ad_concept, initial_image = run_async(bootstrap())
+
+            if st.session_state.ad_concept:
                 if initial_image:
                     st.session_state.iterations.append({
                         'iteration': 0,
-                        'image': initial_image,
+                        'image_bytes': initial_image,
                         'instructions': st.session_state.ad_concept['image_edit_instructions'],
                         'type': 'generate'
                     })
@@ -267,7 +566,7 @@ def main():
     # Display current status
     if st.session_state.ad_concept:
         st.write("### Current Advertising Concept")
-        st.json(st.session_state.ad_concept)
+        render_concept(st.session_state.ad_concept)
     
     # Generate editing iterations
     if st.session_state.ad_concept and st.session_state.current_iteration < st.session_state.max_iterations:
@@ -277,40 +576,106 @@ def main():
                 return
                 
             with st.spinner(f"Applying iteration {st.session_state.current_iteration + 1}..."):
-                last_image = st.session_state.iterations[-1]['image']
-                
-                # Get analysis and improvement instructions
-                analysis = analyze_and_improve(
-                    last_image,
-                    st.session_state.ad_concept,
-                    st.session_state.current_iteration
-                )
-                
+                last_image_bytes = st.session_state.iterations[-1]['image_bytes']
+                # Only the last iteration is downloaded; intermediates just
+                # feed the next critique, so render them as fast drafts
+                is_final = st.session_state.current_iteration + 1 >= st.session_state.max_iterations
+
+                async def apply_planned_iteration():
+                    # Plan all steps with one chat call on the first click,
+                    # then apply one planned edit per click with no further
+                    # gpt-4-turbo round-trips
+                    if st.session_state.edit_plan is None:
+                        st.session_state.edit_plan = await generate_edit_plan(
+                            last_image_bytes,
+                            st.session_state.ad_concept,
+                            st.session_state.max_iterations
+                        )
+                    plan = st.session_state.edit_plan
+                    if not plan:
+                        return None, None
+
+                    step = plan[min(st.session_state.current_iteration, len(plan) - 1)]
+                    result = await edit_image_with_prompt(
+                        last_image_bytes,
+                        step['edit_instructions'],
+                        final=is_final
+                    )
+                    analysis = {
+                        'recommendation': 'edit',
+                        'edit_instructions': step['edit_instructions'],
+                        'critique': f"Planned edit step {step.get('step', st.session_state.current_iteration + 1)}"
+                    }
+                    return analysis, result
+
+                async def apply_iteration():
+                    # Start the edit as soon as its instructions are
+                    # complete in the critique stream, overlapping the tail
+                    # of the critique with the head of the edit upload
+                    edit_task = None
+
+                    def start_edit(edit_instructions):
+                        nonlocal edit_task
+                        edit_task = asyncio.create_task(edit_image_with_prompt(
+                            last_image_bytes,
+                            edit_instructions,
+                            final=is_final
+                        ))
+
+                    # Get analysis and improvement instructions
+                    analysis = await analyze_and_improve(
+                        last_image_bytes,
+                        st.session_state.ad_concept,
+                        st.session_state.current_iteration,
+                        on_edit_ready=start_edit
+                    )
+
+                    if not analysis:
+                        if edit_task:
+                            edit_task.cancel()
+                        return None, None
+
+                    # Based on the recommendation, either edit the existing image or generate a new one
+                    if analysis['recommendation'] == 'edit':
+                        if edit_task:
+                            result = await edit_task
+                        else:
+                            # Cached critique: no stream, so edit directly
+                            result = await edit_image_with_prompt(
+                                last_image_bytes,
+                                analysis['edit_instructions'],
+                                final=is_final
+                            )
+                    else:  # recommendation is 'new'
+                        if edit_task:
+                            edit_task.cancel()
+                        # Generate a new image
+                        result = await generate_initial_image(
+                            analysis['generation_instructions'],
+                            final=is_final
+                        )
+                    return analysis, result
+
+                if reanalyze_each_step or st.session_state.max_iterations == 1:
+                    analysis, result_image = run_async(apply_iteration())
+                else:
+                    analysis, result_image = run_async(apply_planned_iteration())
+
                 if not analysis:
                     st.error("Failed to generate improvement instructions")
                     return
-                
-                # Based on the recommendation, either edit the existing image or generate a new one
+
                 if analysis['recommendation'] == 'edit':
-                    # Apply edit to the existing image
-                    result_image = edit_image_with_prompt(
-                        last_image,
-                        analysis['edit_instructions']
-                    )
                     instruction_text = analysis['edit_instructions']
                     op_type = 'edit'
-                else:  # recommendation is 'new'
-                    # Generate a new image
-                    result_image = generate_initial_image(
-                        analysis['generation_instructions']
-                    )
+                else:
                     instruction_text = analysis['generation_instructions']
                     op_type = 'generate'
-                
+
                 if result_image:
                     st.session_state.iterations.append({
                         'iteration': st.session_state.current_iteration + 1,
-                        'image': result_image,
+                        'image_bytes': result_image,
                         'instructions': instruction_text,
                         'critique': analysis['critique'],
                         'recommendation': analysis['recommendation'],
@@ -330,17 +695,18 @@ def main():
                 col1, col2 = st.columns([1, 1])
                 
                 with col1:
-                    st.image(iteration['image'], use_container_width=True)
                     operation = "Generated" if iteration.get('type') == 'generate' else "Edited"
-                    st.caption(f"{operation} with: {iteration.get('instructions', 'No instructions')}")
-                
+                    render_iteration_image(
+                        iteration['image_bytes'],
+                        f"{operation} with: {iteration.get('instructions', 'No instructions')}"
+                    )
+
                 with col2:
                     if i > 0:  # Skip for the initial image
-                        st.write("### Feedback")
-                        st.write(iteration.get('critique', 'No critique available'))
-                        if 'recommendation' in iteration:
-                            recommendation = iteration['recommendation']
-                            st.write(f"**AI Recommendation:** {recommendation.capitalize()} the image")
+                        render_feedback(
+                            iteration.get('critique', 'No critique available'),
+                            iteration.get('recommendation')
+                        )
 
     # Final result
     if (st.session_state.iterations and 
@@ -348,10 +714,9 @@ def main():
         st.success("🎉 Editing process complete!")
         
         if st.session_state.iterations:
-            final_image = st.session_state.iterations[-1]['image']
             st.download_button(
                 label="Download Final Image",
-                data=base64.b64decode(final_image.split(",")[1]),
+                data=st.session_state.iterations[-1]['image_bytes'],
                 file_name="edited_image.png",
                 mime="image/png"
             )